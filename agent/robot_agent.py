@@ -1,16 +1,44 @@
 #!/usr/bin/env python3
 import json
+import os
 import time
 import uuid
 import logging
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Union
+import msgspec
 import zenoh
-from zenoh import Reliability
+from zenoh import Reliability, Priority, CongestionControl
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 配置文件路径
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
+
+@lru_cache(maxsize=1)
+def _load_config():
+    """读取并缓存配置文件，读取失败时返回空配置"""
+    try:
+        with open(CONFIG_PATH, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.warning(f'Config file {CONFIG_PATH} not found, using defaults')
+    except Exception as e:
+        logger.error(f'Error reading config file: {e}, using defaults')
+    return {}
+
+# 命令消息结构，未知字段（如cancel命令的reason）会被忽略；
+# 字段允许缺失或为null，与按dict.get读取时的行为一致
+class CmdMsg(msgspec.Struct):
+    task_id: Optional[Union[str, int]] = None
+    target_position: Optional[dict] = None
+    priority: Optional[str] = None
+
 # 抽象机器人接口
 class RobotInterface(ABC):
     @abstractmethod
@@ -89,35 +117,73 @@ class ROSRobotInterface(RobotInterface):
     def is_shutdown(self):
         return self.rospy.is_shutdown()
 
+# 模拟ROS消息结构（与geometry_msgs/sensor_msgs字段保持一致）
+class _Point:
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+class _Quaternion:
+    __slots__ = ('x', 'y', 'z', 'w')
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, w=1.0):
+        self.x = x
+        self.y = y
+        self.z = z
+        self.w = w
+
+class _Pose:
+    __slots__ = ('position', 'orientation')
+
+    def __init__(self, position=None, orientation=None):
+        self.position = position if position is not None else _Point()
+        self.orientation = orientation if orientation is not None else _Quaternion()
+
+class _PoseWithCovariance:
+    __slots__ = ('pose',)
+
+    def __init__(self, pose=None):
+        self.pose = pose if pose is not None else _Pose()
+
+class _PoseWithCovarianceStamped:
+    __slots__ = ('pose',)
+
+    def __init__(self, pose=None):
+        self.pose = pose if pose is not None else _PoseWithCovariance()
+
+class _BatteryState:
+    __slots__ = ('voltage', 'percentage', 'power_supply_status')
+
+    def __init__(self, voltage=0.0, percentage=0.0, power_supply_status=0):
+        self.voltage = voltage
+        self.percentage = percentage
+        self.power_supply_status = power_supply_status
+
 # 模拟机器人接口实现（用于独立测试）
 class MockRobotInterface(RobotInterface):
     def __init__(self):
-        self.pose = {
-            'position': {'x': 0.0, 'y': 0.0, 'z': 0.0},
-            'orientation': {'x': 0.0, 'y': 0.0, 'z': 0.0, 'w': 1.0}
-        }
-        self.battery_state = {
-            'voltage': 12.0,
-            'percentage': 0.95,
-            'power_supply_status': 3
-        }
+        # 状态对象只创建一次，之后原地更新
+        self.pose = _PoseWithCovarianceStamped()
+        self.battery_state = _BatteryState(
+            voltage=12.0,
+            percentage=0.95,
+            power_supply_status=3
+        )
         self.shutdown_flag = False
         logger.info("Mock robot interface initialized for testing")
     
     def get_pose(self):
+        # publish_state每个周期调用一次；返回的是同一个对象，原地更新，不再逐次创建
         # 模拟位置缓慢变化
-        self.pose['position']['x'] += 0.01
-        return type('Pose', (object,), {
-            'pose': type('Pose', (object,), {
-                'pose': type('Pose', (object,), {
-                    'position': type('Point', (object,), self.pose['position'])(),
-                    'orientation': type('Quaternion', (object,), self.pose['orientation'])()
-                })()
-            })()
-        })()
+        self.pose.pose.pose.position.x += 0.01
+        return self.pose
     
     def get_battery_state(self):
-        return type('BatteryState', (object,), self.battery_state)()
+        # 同样返回共享的状态对象
+        return self.battery_state
     
     def send_velocity_command(self, linear_x, angular_z):
         logger.info(f"Mock sending velocity command: linear_x={linear_x}, angular_z={angular_z}")
@@ -137,28 +203,52 @@ class RobotAgent:
         self.robot_id = self._get_robot_id()
         logger.info(f'Robot ID: {self.robot_id}')
 
+        # 预先构建Zenoh主题，避免每次发布时重复拼接
+        self._cmd_key = f'fms/robot/{self.robot_id}/cmd/**'
+        self._pose_key = f'fms/robot/{self.robot_id}/state/pose'
+        self._battery_key = f'fms/robot/{self.robot_id}/state/battery'
+        self._status_key = f'fms/robot/{self.robot_id}/state/status'
+        self._heartbeat_key = f'fms/robot/{self.robot_id}/heartbeat'
+
+        # 预分配固定结构的状态模板，发布时只更新叶子字段
+        self._pose_tmpl = {
+            'position': {'x': 0.0, 'y': 0.0, 'z': 0.0},
+            'orientation': {'x': 0.0, 'y': 0.0, 'z': 0.0, 'w': 1.0},
+            'timestamp': 0.0
+        }
+        self._battery_tmpl = {
+            'voltage': 0.0,
+            'percentage': 0.0,
+            'power_supply_status': 0,
+            'timestamp': 0.0
+        }
+        self._heartbeat_tmpl = {
+            'status': '',
+            'timestamp': 0.0
+        }
+
+        # 消息编解码器
+        self._cmd_decoder = msgspec.json.Decoder(CmdMsg)
+        self._encoder = msgspec.json.Encoder()
+
         # 初始化状态变量
         self.status = 'IDLE'
 
+        # 任务在单个工作线程中按顺序执行，避免阻塞Zenoh回调线程；
+        # 每个任务有独立的取消事件，记录在_tasks中直到任务结束
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._tasks = {}
+        self._tasks_lock = threading.Lock()
+        # 串行化任务状态发布与取消，保证取消后最后发布的状态是CANCELLED
+        self._status_lock = threading.Lock()
+
         # 初始化机器人接口
         self.robot_interface = self._initialize_robot_interface(robot_interface)
 
         # 创建Zenoh会话
         self.zenoh_config = zenoh.Config()
         # 从配置文件读取Zenoh服务器地址
-        import os
-        config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-        default_endpoint = 'tcp/127.0.0.1:7447'
-        try:
-            with open(config_path, 'r') as f:
-                config = json.load(f)
-                endpoint = config.get('zenoh_server_endpoint', default_endpoint)
-        except FileNotFoundError:
-            logger.warning(f'Config file {config_path} not found, using default Zenoh endpoint: {default_endpoint}')
-            endpoint = default_endpoint
-        except Exception as e:
-            logger.error(f'Error reading config file: {e}, using default Zenoh endpoint: {default_endpoint}')
-            endpoint = default_endpoint
+        endpoint = _load_config().get('zenoh_server_endpoint', 'tcp/127.0.0.1:7447')
 
         self.zenoh_config.insert_json5('connect/endpoints', json.dumps([endpoint]))
 
@@ -166,17 +256,45 @@ class RobotAgent:
         self.session = zenoh.open(self.zenoh_config)
         logger.info('Connected to Zenoh successfully')
 
-        # 订阅命令主题
-        self.cmd_sub = self.session.subscribe(
-            f'fms/robot/{self.robot_id}/cmd/**',
-            self.cmd_callback,
-            reliability=Reliability.RELIABLE
+        # 在会话中声明主题，发布/订阅复用声明后的KeyExpr，不再逐次解析校验字符串
+        self._cmd_key = self.session.declare_keyexpr(self._cmd_key)
+        self._pose_key = self.session.declare_keyexpr(self._pose_key)
+        self._battery_key = self.session.declare_keyexpr(self._battery_key)
+        self._status_key = self.session.declare_keyexpr(self._status_key)
+        self._heartbeat_key = self.session.declare_keyexpr(self._heartbeat_key)
+
+        # 按通道预先声明发布者并设置优先级：
+        # 状态变更属于交互类消息，需可靠送达；位姿为低延迟遥测；心跳为后台流量
+        self._status_pub = self.session.declare_publisher(
+            self._status_key,
+            priority=Priority.INTERACTIVE_HIGH,
+            congestion_control=CongestionControl.BLOCK,
+            reliability=Reliability.RELIABLE,
+            express=True
+        )
+        self._pose_pub = self.session.declare_publisher(
+            self._pose_key,
+            priority=Priority.DATA_HIGH,
+            congestion_control=CongestionControl.DROP,
+            express=True
+        )
+        self._battery_pub = self.session.declare_publisher(
+            self._battery_key,
+            priority=Priority.DATA,
+            congestion_control=CongestionControl.DROP
+        )
+        self._heartbeat_pub = self.session.declare_publisher(
+            self._heartbeat_key,
+            priority=Priority.BACKGROUND,
+            congestion_control=CongestionControl.DROP
         )
 
+        # 订阅命令主题
+        self.cmd_sub = self.session.declare_subscriber(self._cmd_key, self.cmd_callback)
+
     def _get_robot_id(self):
-        # 尝试从环境变量获取robot_id，否则生成UUID
-        import os
-        return os.getenv('ROBOT_ID', str(uuid.uuid4()))
+        # 尝试从环境变量获取robot_id，否则生成UUID（32位十六进制，不含连字符）
+        return os.getenv('ROBOT_ID') or uuid.uuid4().hex
 
     def _initialize_robot_interface(self, robot_interface):
         if robot_interface:
@@ -194,8 +312,8 @@ class RobotAgent:
         """处理接收到的命令"""
         try:
             # 解析命令
-            cmd_key = sample.key_expr.as_string()
-            cmd_data = json.loads(sample.payload.decode('utf-8'))
+            cmd_key = str(sample.key_expr)
+            cmd_data = self._cmd_decoder.decode(bytes(sample.payload))
             logger.info(f'Received command: {cmd_key}, Data: {cmd_data}')
 
             # 提取命令类型
@@ -203,8 +321,12 @@ class RobotAgent:
 
             # 处理不同类型的命令
             if cmd_type == 'task':
-                # 执行任务命令
-                self.execute_task(cmd_data)
+                # 提交任务到线程池，回调立即返回
+                cancel_event = threading.Event()
+                future = self._executor.submit(self.execute_task, cmd_data, cancel_event)
+                with self._tasks_lock:
+                    self._tasks[future] = cancel_event
+                future.add_done_callback(self._on_task_done)
             elif cmd_type == 'cancel':
                 # 取消当前任务
                 self.cancel_task()
@@ -216,33 +338,63 @@ class RobotAgent:
             logger.error(f'Error processing command: {str(e)}')
             self.update_status('ERROR', str(e))
 
-    def execute_task(self, task_data):
+    def execute_task(self, task_data, cancel_event):
         """执行任务命令"""
-        # 更新状态为运行中
-        self.update_status('RUNNING', f'Executing task: {task_data.get("task_id", "unknown")}')
+        # 更新状态为运行中；任务在开始前已被取消时不再发布
+        with self._status_lock:
+            if cancel_event.is_set():
+                return
+            self.update_status('RUNNING', f'Executing task: {task_data.task_id or "unknown"}')
 
         # 这里添加实际执行任务的逻辑
         # 例如，发布速度命令或调用导航接口
         structured_task = {
-            "task_id": task_data.get("task_id"),
-            "target_position": task_data.get("target_position"),
-            "priority": task_data.get("priority"),
+            "task_id": task_data.task_id,
+            "target_position": task_data.target_position,
+            "priority": task_data.priority,
             "timestamp": time.time()
         }
         logger.info(f'Executing task: {structured_task}')
 
         # 模拟任务执行
         # 在实际应用中，这里应该是与导航系统的交互
-        time.sleep(2)
+        if cancel_event.wait(2):
+            # 任务已被取消，状态由cancel_task发布
+            return
 
         # 更新状态为完成
-        self.update_status('COMPLETED', f'Task {task_data.get("task_id", "unknown")} completed successfully')
+        with self._status_lock:
+            if cancel_event.is_set():
+                return
+            self.update_status('COMPLETED', f'Task {task_data.task_id or "unknown"} completed successfully')
+
+    def _on_task_done(self, future):
+        """任务结束回调，上报执行过程中的异常"""
+        with self._tasks_lock:
+            self._tasks.pop(future, None)
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is not None:
+            logger.error(f'Error executing task: {str(e)}')
+            self.update_status('ERROR', str(e))
 
     def cancel_task(self):
         """取消当前任务"""
-        # 发布停止命令
-        self.robot_interface.send_velocity_command(0, 0)
-        self.update_status('CANCELLED', 'Task cancelled by user command')
+        with self._status_lock:
+            # 通知正在执行的任务退出，并取消尚未开始的任务
+            self._cancel_pending_tasks()
+
+            # 发布停止命令
+            self.robot_interface.send_velocity_command(0, 0)
+            self.update_status('CANCELLED', 'Task cancelled by user command')
+
+    def _cancel_pending_tasks(self):
+        with self._tasks_lock:
+            tasks = list(self._tasks.items())
+        for future, cancel_event in tasks:
+            cancel_event.set()
+            future.cancel()
 
     def update_status(self, status, message=''):
         """更新并发布机器人状态"""
@@ -252,46 +404,43 @@ class RobotAgent:
             'message': message,
             'timestamp': self.robot_interface.get_current_time()
         }
-        self.session.put(
-            f'fms/robot/{self.robot_id}/state/status',
-            json.dumps(status_data),
-            reliability=Reliability.RELIABLE
-        )
+        self._status_pub.put(self._encoder.encode(status_data))
 
     def publish_state(self):
         """发布机器人状态"""
-        if self.pose is not None:
-            pose_data = {
-                'position': {
-                    'x': self.pose.pose.pose.position.x,
-                    'y': self.pose.pose.pose.position.y,
-                    'z': self.pose.pose.pose.position.z
-                },
-                'orientation': {
-                    'x': self.pose.pose.pose.orientation.x,
-                    'y': self.pose.pose.pose.orientation.y,
-                    'z': self.pose.pose.pose.orientation.z,
-                    'w': self.pose.pose.pose.orientation.w
-                },
-                'timestamp': self.robot_interface.get_current_time()
-            }
-            self.session.put(f'fms/robot/{self.robot_id}/state/pose', json.dumps(pose_data))
-
-        if self.battery_state is not None:
-            battery_data = {
-                'voltage': self.battery_state.voltage,
-                'percentage': self.battery_state.percentage,
-                'power_supply_status': self.battery_state.power_supply_status,
-                'timestamp': self.robot_interface.get_current_time()
-            }
-            self.session.put(f'fms/robot/{self.robot_id}/state/battery', json.dumps(battery_data))
+        # 每个周期只取一次时间，三条消息共用同一时间戳
+        now = self.robot_interface.get_current_time()
+        pose_msg = self.robot_interface.get_pose()
+        battery = self.robot_interface.get_battery_state()
+
+        if pose_msg is not None:
+            pose = pose_msg.pose.pose
+            p = self._pose_tmpl
+            position = p['position']
+            position['x'] = pose.position.x
+            position['y'] = pose.position.y
+            position['z'] = pose.position.z
+            orientation = p['orientation']
+            orientation['x'] = pose.orientation.x
+            orientation['y'] = pose.orientation.y
+            orientation['z'] = pose.orientation.z
+            orientation['w'] = pose.orientation.w
+            p['timestamp'] = now
+            self._pose_pub.put(self._encoder.encode(p))
+
+        if battery is not None:
+            b = self._battery_tmpl
+            b['voltage'] = battery.voltage
+            b['percentage'] = battery.percentage
+            b['power_supply_status'] = battery.power_supply_status
+            b['timestamp'] = now
+            self._battery_pub.put(self._encoder.encode(b))
 
         # 发布心跳
-        heartbeat_data = {
-            'status': self.status,
-            'timestamp': self.robot_interface.get_current_time()
-        }
-        self.session.put(f'fms/robot/{self.robot_id}/heartbeat', json.dumps(heartbeat_data))
+        h = self._heartbeat_tmpl
+        h['status'] = self.status
+        h['timestamp'] = now
+        self._heartbeat_pub.put(self._encoder.encode(h))
 
     def run(self):
         """运行机器人代理主循环"""
@@ -299,11 +448,18 @@ class RobotAgent:
             while not self.robot_interface.is_shutdown():
                 self.publish_state()
                 time.sleep(1)  # 1Hz循环
-        except rospy.ROSInterruptException:
+        except KeyboardInterrupt:
             pass
         finally:
+            # 先停止接收命令，再取消所有未完成的任务并等待线程池退出
+            # （_cancel_pending_tasks已取消排队中的任务，无需Python 3.9的cancel_futures）
+            self.cmd_sub.undeclare()
+            self._cancel_pending_tasks()
+            self._executor.shutdown(wait=True)
+
             # 关闭Zenoh会话
-            self.cmd_sub.close()
+            for pub in (self._status_pub, self._pose_pub, self._battery_pub, self._heartbeat_pub):
+                pub.undeclare()
             self.session.close()
             logger.info('Zenoh session closed')
 
@@ -6,10 +6,12 @@ import asyncio
 import json
 import threading
 import time
+from typing import List, Union
 
 import websockets
 import numpy as np
 import logging
+import msgspec
 import zenoh
 
 # Configure logging
@@ -17,17 +19,34 @@ logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
+class PhoneMsg(msgspec.Struct):
+    """message sent by the phone app on every frame (flags may be bools or ints, read by truthiness)"""
+    buttonStates: List[Union[bool, int]]
+    isSwitch1On: Union[bool, int]
+    isSwitch2On: Union[bool, int]
+    rotation: List[float] = msgspec.field(default_factory=lambda: [0.0, 0.0, 0.0, 1.0])
+
+
 class PhoneServer:
     def __init__(self, translation_step, host="0.0.0.0", port=8765, update_dt=1 / 50, zenoh_key="fms/phone_server", zenoh_connect_address=None):
         self.host = host
         self.port = port
         self.update_dt = update_dt
         self.translation_step = translation_step
+
+        # button -> delta matrix: rows are the x/y/z axes, columns are buttons 0..5
+        step = translation_step
+        self._button_delta_matrix = np.array([
+            [0.0, 0.0, 0.0, step, -step, 0.0],
+            [0.0, 0.0, -step, 0.0, 0.0, step],  # todo: check why the y axis is inversed
+            [-step, step, 0.0, 0.0, 0.0, 0.0],
+        ], dtype=np.float64)
+
+        self._decoder = msgspec.json.Decoder(PhoneMsg)
+        self._encoder = msgspec.json.Encoder()
         self.zenoh_key = zenoh_key
         self.zenoh_connect_address = zenoh_connect_address
 
-        self._lock = threading.Lock()
-
         self._latest_data = {
             "buttonStates": [False] * 6,
             "isSwitch1On": False,
@@ -35,10 +54,12 @@ class PhoneServer:
             "rotation": [0.0, 0.0, 0.0, 1.0],
         }
 
-        self.q_world = np.array([0.0, 0.0, 0.0, 1.0], dtype=np.float64)
-        self.delta_position = np.zeros(3)
+        # latest (q_world, delta_position, gripper_flag) snapshot. the handler publishes
+        # a new tuple with one reference assignment (atomic under the GIL) and never
+        # mutates a published snapshot, so readers that take self._latest once
+        # always see a consistent frame without a lock
+        self._latest = (np.array([0.0, 0.0, 0.0, 1.0], dtype=np.float64), np.zeros(3), False)
         self.rotation_flag = False
-        self.gripper_flag = False
         self.receive_flag = False
 
         # Zenoh
@@ -60,32 +81,17 @@ class PhoneServer:
         except Exception as e:
             log.error(f"Failed to initialize Zenoh: {e}")
 
-    def key_map(self, data):
-        delta_position = np.zeros(3)
-
-        button_states = data["buttonStates"]
-        isSwitch1On = data["isSwitch1On"]
-        isSwitch2On = data["isSwitch2On"]
-
-        rotation_flag = True if isSwitch1On else False
-        gripper_flag = True if isSwitch2On else False
-
-        # kep map
-        if button_states[0]:
-            delta_position[2] = -self.translation_step
-        if button_states[1]:
-            delta_position[2] = self.translation_step
-        if button_states[2]:  # todo: check why the y axis is inversed
-            delta_position[1] = -self.translation_step
-        if button_states[5]:
-            delta_position[1] = self.translation_step
-        if button_states[4]:
-            delta_position[0] = -self.translation_step
-        if button_states[3]:
-            delta_position[0] = self.translation_step
-
-        q_world = data.get("rotation", [0.0, 0.0, 0.0, 1.0])[:4]
-        q_world = np.array(q_world, dtype=np.float64)
+    def key_map(self, msg):
+        """
+        map a PhoneMsg to (q_world, delta_position, gripper_flag); both arrays are freshly allocated.
+        """
+        rotation_flag = True if msg.isSwitch1On else False
+        gripper_flag = True if msg.isSwitch2On else False
+
+        # key map: opposite buttons pressed together cancel out
+        delta_position = self._button_delta_matrix @ np.asarray(msg.buttonStates[:6], dtype=bool)
+
+        q_world = np.asarray(msg.rotation[:4], dtype=np.float64)
 
         return q_world, delta_position, gripper_flag
 
@@ -96,32 +102,30 @@ class PhoneServer:
         """
 
         log.info("A client connected.")
-        time.sleep(3)
         self.receive_flag = True
 
         while True:
             try:
                 message = await websocket.recv()
-                log.info(f"Received from client: {message}") # Log the raw message
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Received from client: %s", message)  # Log the raw message
 
-                data = json.loads(message)
+                msg = self._decoder.decode(message)
 
-                q_world, delta_position, gripper_flag = self.key_map(data)
+                q_world, delta_position, gripper_flag = self.key_map(msg)
 
-                # update latest data (thread-safe)
-                with self._lock:
-                    self.q_world = q_world
-                    self.delta_position = delta_position
-                    self.gripper_flag = gripper_flag
+                # update latest data (lock-free, see _latest).
+                # key_map returns fresh arrays, so they can be published as-is
+                self._latest = (q_world, delta_position, gripper_flag)
                 
                 # Publish to Zenoh
                 if self.z_pub:
                     payload = {
-                        "orientation": q_world.tolist(),
+                        "orientation": msg.rotation[:4],
                         "position_change": delta_position.tolist(),
                         "gripper_on": gripper_flag
                     }
-                    self.z_pub.put(json.dumps(payload))
+                    self.z_pub.put(self._encoder.encode(payload))
 
 
             except websockets.ConnectionClosed:
@@ -161,12 +165,20 @@ class PhoneServer:
         get the latest position, orientation (thread-safe).
         return: (position: np.ndarray, orientation: np.ndarray)
         """
-        with self._lock:
-            # pos = self._latest_data["position"].copy()
-            q_world = self.q_world.copy()
-            delta_position = self.delta_position.copy()
-            gripper_flag = self.gripper_flag
-        return q_world, delta_position, gripper_flag
+        q_world, delta_position, gripper_flag = self._latest
+        return q_world.copy(), delta_position.copy(), gripper_flag
+
+    @property
+    def q_world(self):
+        return self._latest[0]
+
+    @property
+    def delta_position(self):
+        return self._latest[1]
+
+    @property
+    def gripper_flag(self):
+        return self._latest[2]
 
     @property
     def _latest_position(self):
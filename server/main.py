@@ -1,17 +1,58 @@
 import asyncio
+import heapq
 import json
+import os
 import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set, Tuple
 from contextlib import asynccontextmanager
+from functools import lru_cache
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
+import msgspec
 import zenoh
-from zenoh import Session, Reliability, Priority
+from zenoh import Session, Priority
+
+
+def _install_event_loop_policy():
+    """优先使用基于io_uring的事件循环（Linux >= 5.11），否则回退到uvloop，均不可用时保持默认"""
+    try:
+        release = os.uname().release.split('-')[0].split('.')
+        kernel = (int(release[0]), int(release[1]))
+    except (AttributeError, IndexError, ValueError):
+        kernel = (0, 0)
+
+    if kernel >= (5, 11):
+        try:
+            import uringcore
+            asyncio.set_event_loop_policy(uringcore.EventLoopPolicy())
+            return
+        except ImportError:
+            pass
+
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
 
 zenoh_session: Optional[zenoh.Session] = None
 
+@lru_cache(maxsize=1)
+def _load_config() -> Dict[str, Any]:
+    """读取并缓存 config.json，文件不存在时返回空配置"""
+    try:
+        with open('config.json', 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print("Warning: config.json not found, using default Zenoh endpoint.")
+        return {}
+
+# 复用的JSON编解码器；状态数据结构不固定，按任意JSON值解码
+_state_decoder = msgspec.json.Decoder()
+_encoder = msgspec.json.Encoder()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global zenoh_session
@@ -22,23 +63,21 @@ async def lifespan(app: FastAPI):
     # 1. zenoh.open() is a SYNCHRONOUS function that returns a Session.
     #    No await, no async with.
     config = zenoh.Config()
-    # 从配置文件读取 Zenoh 服务器地址
-    try:
-        with open('config.json', 'r') as f:
-            config_data = json.load(f)
-            zenoh_endpoint = config_data.get('zenoh_server_endpoint', 'tcp/127.0.0.1:7447')
-    except FileNotFoundError:
-        zenoh_endpoint = 'tcp/127.0.0.1:7447'
-        print("Warning: config.json not found, using default Zenoh endpoint.")
+    # 从配置文件读取 Zenoh 服务器地址（在线程中读取，不阻塞事件循环）
+    config_data = await asyncio.get_running_loop().run_in_executor(None, _load_config)
+    zenoh_endpoint = config_data.get('zenoh_server_endpoint', 'tcp/127.0.0.1:7447')
     config.insert_json5("connect/endpoints", f'["{zenoh_endpoint}"]')
     session = zenoh.open(config)
     zenoh_session = session  # Assign to the global variable
     
     print("Zenoh session opened successfully.")
 
-    # 2. Start background tasks with the valid session object.
-    subscribe_task = asyncio.create_task(zenoh_subscribe(session))
+    # 2. Declare subscribers and start background tasks with the valid session object.
+    #    Zenoh invokes subscriber callbacks on its own thread; they hand work
+    #    back to this loop.
+    subscribers = zenoh_subscribe(session, asyncio.get_running_loop())
     offline_checker_task = asyncio.create_task(state_manager.check_offline_robots())
+    broadcaster_task = asyncio.create_task(state_manager.broadcaster())
 
     try:
         # FastAPI runs here
@@ -48,9 +87,11 @@ async def lifespan(app: FastAPI):
         print("Application shutdown: Cleaning up...")
         
         # 3. Cleanly cancel the background tasks.
-        subscribe_task.cancel()
         offline_checker_task.cancel()
-        await asyncio.gather(subscribe_task, offline_checker_task, return_exceptions=True)
+        broadcaster_task.cancel()
+        await asyncio.gather(offline_checker_task, broadcaster_task, return_exceptions=True)
+        for subscriber in subscribers:
+            subscriber.undeclare()
         print("Background tasks cancelled.")
         
         # 4. zenoh.Session.close() is also a SYNCHRONOUS function.
@@ -72,10 +113,22 @@ class RobotState(BaseModel):
     custom_state: Dict[str, Any] = {}
 
 class RobotStateManager:
-    def __init__(self):
+    """
+    机器人状态只在事件循环中修改。lock用于串行化写入方；
+    只读访问中间没有await，不会看到修改到一半的状态，因此无需加锁。
+    """
+    def __init__(self, offline_threshold: int = 5):
         self.robot_states: Dict[str, RobotState] = {}
-        self.websocket_connections: List[WebSocket] = []
+        self.websocket_connections: Set[WebSocket] = set()
         self.lock = asyncio.Lock()
+        self.offline_threshold = offline_threshold
+        # (离线截止时间, robot_id) 最小堆，每次状态更新压入一项
+        self._deadline_heap: List[Tuple[float, str]] = []
+        # 待广播的更新，按(robot_id, state_type)合并，只保留最新值
+        self._out_queue: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        # 在broadcaster启动时于运行中的事件循环上创建；
+        # Python 3.10以前Event会绑定到导入时的循环，与uvicorn的循环不同
+        self._ready: Optional[asyncio.Event] = None
 
     async def update_robot_state(self, robot_id: str, state_type: str, data: Any):
         async with self.lock:
@@ -85,6 +138,7 @@ class RobotStateManager:
             robot = self.robot_states[robot_id]
             robot.last_seen = time.time()
             robot.status = "ONLINE"
+            heapq.heappush(self._deadline_heap, (robot.last_seen + self.offline_threshold, robot_id))
 
             if state_type == "pose":
                 robot.pose = data
@@ -96,90 +150,161 @@ class RobotStateManager:
                 robot.custom_state[state_type] = data
 
             # 广播状态更新
-            await self.broadcast_update(robot_id, state_type, data)
-
-    async def broadcast_update(self, robot_id: str, state_type: str, data: Any):
-        update_msg = json.dumps({
-            "msg_type": "state_update",
-            "robot_id": robot_id,
-            "state_type": state_type,
-            "data": data,
-            "timestamp": time.time()
-        })
-
-        for connection in self.websocket_connections:
-            try:
-                await connection.send_text(update_msg)
-            except Exception:
-                # 移除无效连接
-                await self.remove_connection(connection)
+            self.broadcast_update(robot_id, state_type, data)
+
+    def broadcast_update(self, robot_id: str, state_type: str, data: Any):
+        """将更新放入合并队列，由broadcaster任务统一发送，不阻塞状态写入"""
+        self._out_queue[(robot_id, state_type)] = (data, time.time())
+        # broadcaster尚未启动时只入队，启动后会先发送已积累的更新
+        if self._ready is not None:
+            self._ready.set()
+
+    async def broadcaster(self):
+        """取出合并后的更新，每条只序列化一次后并发发送给所有连接"""
+        self._ready = asyncio.Event()
+        if self._out_queue:
+            self._ready.set()
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            pending, self._out_queue = self._out_queue, {}
+
+            connections = list(self.websocket_connections)
+            if not connections:
+                continue
+
+            # 仍以文本帧发送，前端按字符串解析JSON
+            messages = [
+                _encoder.encode({
+                    "msg_type": "state_update",
+                    "robot_id": robot_id,
+                    "state_type": state_type,
+                    "data": data,
+                    "timestamp": timestamp
+                }).decode('utf-8')
+                for (robot_id, state_type), (data, timestamp) in pending.items()
+            ]
+
+            results = await asyncio.gather(
+                *[self._send_all(connection, messages) for connection in connections],
+                return_exceptions=True
+            )
+
+            # 一次性移除无效连接
+            failed = [connection for connection, result in zip(connections, results)
+                      if isinstance(result, Exception)]
+            if failed:
+                self.websocket_connections.difference_update(failed)
+
+    @staticmethod
+    async def _send_all(connection: WebSocket, messages: List[str]):
+        for message in messages:
+            await connection.send_text(message)
 
     async def add_connection(self, websocket: WebSocket):
         async with self.lock:
-            self.websocket_connections.append(websocket)
+            self.websocket_connections.add(websocket)
 
     async def remove_connection(self, websocket: WebSocket):
         async with self.lock:
-            if websocket in self.websocket_connections:
-                self.websocket_connections.remove(websocket)
+            self.websocket_connections.discard(websocket)
 
-    async def check_offline_robots(self, threshold: int = 5):
+    async def check_offline_robots(self):
         while True:
             current_time = time.time()
             offline_robots = []
 
             async with self.lock:
-                for robot_id, robot in self.robot_states.items():
-                    if current_time - robot.last_seen > threshold and robot.status != "OFFLINE":
-                        robot.status = "OFFLINE"
-                        offline_robots.append(robot_id)
-                        await self.broadcast_update(robot_id, "status", "OFFLINE")
+                # 只处理已到期的截止时间，而不是扫描全部机器人
+                while self._deadline_heap and self._deadline_heap[0][0] <= current_time:
+                    _, robot_id = heapq.heappop(self._deadline_heap)
+                    robot = self.robot_states.get(robot_id)
+                    # 跳过之后又有更新的过期堆项
+                    if robot is None or robot.status == "OFFLINE":
+                        continue
+                    if robot.last_seen + self.offline_threshold > current_time:
+                        continue
+                    robot.status = "OFFLINE"
+                    offline_robots.append(robot_id)
+                    self.broadcast_update(robot_id, "status", "OFFLINE")
 
             # 发布离线事件
+            # 单个发布失败不能终止整个离线检测任务
             for robot_id in offline_robots:
-                await zenoh_publish(f"fms/system/event/robot_offline", {
-                    "robot_id": robot_id,
-                    "timestamp": current_time
-                })
+                try:
+                    await zenoh_publish(f"fms/system/event/robot_offline", {
+                        "robot_id": robot_id,
+                        "timestamp": current_time
+                    })
+                except Exception as e:
+                    print(f"发布机器人{robot_id}离线事件失败: {e}")
 
             await asyncio.sleep(1)
 
 state_manager = RobotStateManager()
 zenoh_session: Optional[Session] = None
-async def zenoh_subscribe(session: Session):
-    """订阅机器人状态更新"""
-    async def callback(sample):
-        """处理接收到的状态更新"""
+
+# 单独订阅的状态类型，其robot_id可直接按固定前缀截取
+_STATE_KEY_PREFIX = 'fms/robot/'
+_STATE_KEY_INFIX = '/state/'
+_STATE_TYPES = ('pose', 'battery', 'status')
+_STATE_KEY_SUFFIXES = tuple(_STATE_KEY_INFIX + state_type for state_type in _STATE_TYPES)
+
+def zenoh_subscribe(session: Session, loop: asyncio.AbstractEventLoop) -> List[Any]:
+    """订阅机器人状态更新，返回订阅者句柄（关闭时需undeclare）"""
+    def update(sample, robot_id: str, state_type: str):
+        try:
+            # 直接解码原始字节，省去先解码为str的一次拷贝
+            data = _state_decoder.decode(bytes(sample.payload))
+        except msgspec.DecodeError:
+            print(f"无法解析机器人{robot_id}的{state_type}状态数据")
+            return
+        # 回调运行在Zenoh线程中，状态更新交给事件循环执行
+        asyncio.run_coroutine_threadsafe(
+            state_manager.update_robot_state(robot_id, state_type, data), loop)
+
+    def callback(sample, state_type: str):
+        """处理已知类型的状态更新: fms/robot/{robot_id}/state/{state_type}"""
+        key = str(sample.key_expr)
+        robot_id = key[len(_STATE_KEY_PREFIX):key.find(_STATE_KEY_INFIX)]
+        update(sample, robot_id, state_type)
+
+    def fallback_callback(sample):
+        """处理其它类型的状态更新"""
+        key = str(sample.key_expr)
+        # `**`也会匹配专用订阅的类型，在解析前直接丢弃
+        if key.endswith(_STATE_KEY_SUFFIXES):
+            return
+
         # 解析key: fms/robot/{robot_id}/state/{state_type}
-        key_parts = sample.key_expr.split('/')
+        key_parts = key.split('/')
         if len(key_parts) < 5 or key_parts[0] != 'fms' or key_parts[1] != 'robot' or key_parts[3] != 'state':
             return
 
         robot_id = key_parts[2]
         state_type = '/'.join(key_parts[4:])
 
-        try:
-            data = json.loads(sample.payload.decode('utf-8'))
-            await state_manager.update_robot_state(robot_id, state_type, data)
-        except json.JSONDecodeError:
-            print(f"无法解析机器人{robot_id}的{state_type}状态数据")
+        update(sample, robot_id, state_type)
+
+    # 按状态类型分别订阅，回调中无需再解析state_type
+    subscribers = [
+        session.declare_subscriber(f"fms/robot/*/state/{state_type}",
+                                   lambda sample, state_type=state_type: callback(sample, state_type))
+        for state_type in _STATE_TYPES
+    ]
 
-    # 订阅所有机器人状态
-    await session.subscribe("fms/robot/*/state/**", callback,
-                           reliability=Reliability.RELIABLE())
+    # 订阅其余机器人状态
+    subscribers.append(session.declare_subscriber("fms/robot/*/state/**", fallback_callback))
+    return subscribers
 
 async def zenoh_publish(key: str, data: Any, priority: Priority = Priority.DEFAULT):
     """发布数据到Zenoh"""
     if zenoh_session is None:
         return
 
-    payload = json.dumps(data).encode('utf-8')
-    await zenoh_session.put(
-        key,
-        payload,
-        priority=priority,
-        reliability=Reliability.RELIABLE()
-    )
+    payload = _encoder.encode(data)
+    # Zenoh 1.x的put是同步调用，可靠性由会话配置决定
+    zenoh_session.put(key, payload, priority=priority)
 
 # 任务调度逻辑
 class TaskRequest(BaseModel):
@@ -194,27 +319,25 @@ class TaskResponse(BaseModel):
 
 async def schedule_robot(task: TaskRequest) -> Optional[str]:
     """使用前端指定的机器人ID执行任务"""
-    async with state_manager.lock:
-        robot_id = task.robot_id
-        robot = state_manager.robot_states.get(robot_id)
-        
-        # 检查机器人是否存在、在线且电量充足
-        if robot and robot.status == "ONLINE" and robot.battery > 20.0:
-            return robot_id
-        return None
+    robot_id = task.robot_id
+    robot = state_manager.robot_states.get(robot_id)
+
+    # 检查机器人是否存在、在线且电量充足
+    if robot and robot.status == "ONLINE" and robot.battery > 20.0:
+        return robot_id
+    return None
 
 # HTTP API 路由
 @app.get("/api/robots")
 async def get_all_robots():
-    async with state_manager.lock:
-        return list(state_manager.robot_states.values())
+    return list(state_manager.robot_states.values())
 
 @app.get("/api/robots/{robot_id}")
 async def get_robot(robot_id: str):
-    async with state_manager.lock:
-        if robot_id not in state_manager.robot_states:
-            raise HTTPException(status_code=404, detail="机器人不存在")
-        return state_manager.robot_states[robot_id]
+    robot = state_manager.robot_states.get(robot_id)
+    if robot is None:
+        raise HTTPException(status_code=404, detail="机器人不存在")
+    return robot
 
 @app.post("/api/tasks", response_model=TaskResponse)
 async def create_task(task: TaskRequest):
@@ -231,7 +354,7 @@ async def create_task(task: TaskRequest):
     }
 
     # 发送任务给机器人，使用高优先级
-    priority = Priority.REAL_TIME if task.priority == "high" else Priority.NORMAL
+    priority = Priority.REAL_TIME if task.priority == "high" else Priority.DATA
     await zenoh_publish(
         f"fms/robot/{robot_id}/cmd/task",
         task_data,
@@ -246,9 +369,8 @@ async def create_task(task: TaskRequest):
 
 @app.post("/api/robots/{robot_id}/cancel")
 async def cancel_task(robot_id: str):
-    async with state_manager.lock:
-        if robot_id not in state_manager.robot_states:
-            raise HTTPException(status_code=404, detail="机器人不存在")
+    if robot_id not in state_manager.robot_states:
+        raise HTTPException(status_code=404, detail="机器人不存在")
 
     cancel_data = {
         "timestamp": time.time(),
@@ -270,10 +392,21 @@ async def websocket_endpoint(websocket: WebSocket):
     await state_manager.add_connection(websocket)
     try:
         while True:
-            # 保持连接，不需要接收客户端消息
-            await asyncio.sleep(30)
-            await websocket.send_text(json.dumps({"msg_type": "heartbeat", "timestamp": time.time()}))
+            # 不需要处理客户端消息，只用于检测断开；
+            # 连接保活由uvicorn发送协议级PING帧完成（--ws-ping-interval）
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
     except WebSocketDisconnect:
+        pass
+    finally:
         await state_manager.remove_connection(websocket)
-    except Exception:
-        await state_manager.remove_connection(websocket)
\ No newline at end of file
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvicorn CLI会在导入本模块前创建事件循环，因此只有直接运行时才能安装uringcore/uvloop；
+    # loop="none"让uvicorn沿用已安装的策略而不是覆盖它
+    _install_event_loop_policy()
+    uvicorn.run(app, host="0.0.0.0", port=8088, loop="none",
+                ws_ping_interval=30, ws_ping_timeout=20)